@@ -1,187 +1,498 @@
+import io
 import os
 import re
-import requests
+import sys
+import asyncio
+import hashlib
+import httpx
+import ahocorasick
 import joblib
+import numpy as np
 import logging
 from pathlib import Path
-from typing import Dict, List, Optional, Any
-import mailparser
-from datetime import datetime
+from functools import cached_property
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, BinaryIO, Callable, Tuple
+from cachetools import TTLCache
+from numba import njit
+from datetime import datetime, timezone
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+try:
+    import onnxruntime as ort
+except ImportError:
+    # Without ONNX Runtime the joblib sklearn model is used
+    ort = None
+
+# Logging is configured by the application (see server.py)
 logger = logging.getLogger(__name__)
 
-class EmailAnalyzer:
-    def __init__(self):
-        """Initialize the email analyzer with ML models"""
-        self.model = None
-        self.vectorizer = None
-        self.load_models()
+# Words that commonly show up in phishing emails
+SUSPICIOUS_WORDS = (
+    'urgent', 'immediate', 'verify', 'confirm', 'suspend', 'limited',
+    'expire', 'click', 'login', 'update', 'security', 'account',
+    'bank', 'paypal', 'amazon', 'microsoft', 'apple', 'google',
+    'winner', 'congratulations', 'prize', 'lottery', 'inheritance',
+    'prince', 'million', 'transfer', 'fund', 'beneficiary',
+    'act now', 'limited time', 'expires today', 'final notice'
+)
+
+# Precompiled patterns, shared by every analysis
+IP_RE = re.compile(r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b')
+URL_RE = re.compile(r'https?://[^\s<>"\']+|www\.[^\s<>"\']+|[^\s]+\.[a-z]{2,}[^\s]*')
+
+def _build_suspicious_automaton() -> ahocorasick.Automaton:
+    """Build an Aho-Corasick automaton matching every suspicious word in one pass"""
+    automaton = ahocorasick.Automaton()
+    # Keys are stored pre-lowered so they match the lowered text being scanned
+    for word in SUSPICIOUS_WORDS:
+        automaton.add_word(word.lower(), word)
+    automaton.make_automaton()
+    return automaton
+
+SUSPICIOUS_AUTOMATON = _build_suspicious_automaton()
+
+def ips_to_octets(ips: List[str]) -> np.ndarray:
+    """Convert dotted quads matched by IP_RE into an (n, 4) octet array"""
+    # IP_RE allows up to three digits per octet, so int16 holds invalid ones too
+    return np.array([ip.split('.') for ip in ips], dtype=np.int16)
+
+@njit(cache=True)
+def classify_ips(octets: np.ndarray) -> np.ndarray:
+    """Return a mask of the rows in an (n, 4) octet array that are public IPv4 addresses"""
+    n = octets.shape[0]
+    mask = np.empty(n, dtype=np.bool_)
+    for i in range(n):
+        a = octets[i, 0]
+        b = octets[i, 1]
+        c = octets[i, 2]
+        d = octets[i, 3]
+        
+        if a > 255 or b > 255 or c > 255 or d > 255:
+            # Not a valid address, e.g. 999.1.1.1
+            mask[i] = False
+        elif a == 0 or a == 10 or a == 127 or a >= 224:
+            # "This" network, private, loopback, multicast and reserved
+            mask[i] = False
+        elif (a == 100 and 64 <= b < 128) or (a == 169 and b == 254):
+            # Carrier-grade NAT and link-local
+            mask[i] = False
+        elif (a == 172 and 16 <= b < 32) or (a == 192 and b == 168):
+            # Private
+            mask[i] = False
+        elif a == 192 and b == 0 and (c == 0 or c == 2):
+            # IETF protocol assignments and TEST-NET-1
+            mask[i] = False
+        elif a == 198 and (b == 18 or b == 19 or (b == 51 and c == 100)):
+            # Benchmarking and TEST-NET-2
+            mask[i] = False
+        elif a == 203 and b == 0 and c == 113:
+            # TEST-NET-3
+            mask[i] = False
+        else:
+            mask[i] = True
+    return mask
+
+# Synthetic email used to warm up the analysis pipeline; its IP is public
+# so the Numba kernel gets compiled (or loaded from its on-disk cache)
+WARMUP_EML = b"""From: warmup@example.com
+To: warmup@example.com
+Subject: Warmup
+Received: from warmup.example.com (8.8.8.8) by mail.example.com
+
+Please verify your account at https://example.com
+"""
+
+MODEL_PATH = Path(__file__).parent / "model_phising.joblib"
+VECTORIZER_PATH = Path(__file__).parent / "tfidf_vectorizer.joblib"
+# Optional ONNX export of the classifier, produced by export_onnx.py
+ONNX_MODEL_PATH = Path(__file__).parent / "model_phising.onnx"
+# ONNX metadata key holding the digest of the joblib model it was exported from
+ONNX_SOURCE_DIGEST_KEY = "source_model_digest"
+
+# Limits for the content-hash result cache; results carry the decoded body,
+# so the cache is bounded by size as well as by entry count
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# ip-api.com batch limit and geolocation cache settings
+GEO_BATCH_SIZE = 100
+GEO_CACHE_SIZE = 10000
+GEO_CACHE_TTL = 24 * 60 * 60
+GEO_TIMEOUT = 5.0
+
+# Emails whose subject + body is shorter than this skip the model and are
+# reported as SAFE with coin-flip confidence
+MIN_CLASSIFIABLE_CHARS = 8
+UNCLASSIFIABLE_CONFIDENCE = 50.0
+
+# Read size used when hashing uploaded emails
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Micro-batching window for concurrent predictions
+BATCH_MAX_SIZE = 32
+BATCH_MAX_WAIT = 0.005
+
+def file_digest(path: Path) -> str:
+    """Hex blake2b digest of a file, used to tie the ONNX export to its joblib source"""
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class PredictionBatcher:
+    """Collect concurrent prediction requests and run them as one sklearn batch"""
     
-    def load_models(self):
-        """Load the ML models and vectorizer"""
+    def __init__(self, predict_batch: Callable[[List[str]], List[Any]],
+                 max_size: int = BATCH_MAX_SIZE, max_wait: float = BATCH_MAX_WAIT):
+        self.predict_batch = predict_batch
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+    
+    async def predict(self, text: str) -> Any:
+        """Queue a text for the next batch and wait for its prediction"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+        
+        future = loop.create_future()
+        await self._queue.put((text, future))
+        return await future
+    
+    async def close(self):
+        """Cancel the background worker; the next predict() starts a fresh one"""
+        worker, self._worker = self._worker, None
+        if worker is None or worker.done():
+            return
+        
+        worker.cancel()
         try:
-            model_path = Path(__file__).parent / "model_phising.joblib"
-            vectorizer_path = Path(__file__).parent / "tfidf_vectorizer.joblib"
+            await worker
+        except asyncio.CancelledError:
+            pass
+    
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        """Wait for one request, then gather more until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        
+        while len(batch) < self.max_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        
+        return batch
+    
+    async def _run(self):
+        """Background task feeding batches to the model in a worker thread"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            texts = [text for text, _ in batch]
             
-            if not model_path.exists():
-                raise FileNotFoundError(f"Model file not found: {model_path}")
-            if not vectorizer_path.exists():
-                raise FileNotFoundError(f"Vectorizer file not found: {vectorizer_path}")
+            try:
+                results = await loop.run_in_executor(None, self.predict_batch, texts)
+            except Exception as e:
+                logger.error("Error predicting batch of %d: %s", len(texts), e)
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, future), result in zip(batch, results):
+                # Requests cancelled while waiting (e.g. client disconnects) are skipped
+                if not future.done():
+                    future.set_result(result)
+
+class EmailAnalyzer:
+    def __init__(self, cache_size: int = RESULT_CACHE_SIZE, cache_max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        """Initialize the email analyzer; ML models are loaded on first use"""
+        self.cache_size = cache_size
+        self.cache_max_bytes = cache_max_bytes
+        self._result_cache: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._result_cache_bytes = 0
+        self.batcher = PredictionBatcher(self._predict_batch)
+        self._geo_cache = TTLCache(maxsize=GEO_CACHE_SIZE, ttl=GEO_CACHE_TTL)
+        self.unclassifiable_count = 0
+        # Shared keep-alive client, installed by the API server at startup
+        self.http_client: Optional[httpx.AsyncClient] = None
+    
+    @cached_property
+    def model(self):
+        """Phishing classifier, memory-mapped from disk on first access"""
+        return self._load_joblib(MODEL_PATH, "Model")
+    
+    @cached_property
+    def vectorizer(self):
+        """TF-IDF vectorizer, memory-mapped from disk on first access"""
+        return self._load_joblib(VECTORIZER_PATH, "Vectorizer")
+    
+    @cached_property
+    def onnx_session(self):
+        """ONNX Runtime session for the classifier, or None to fall back to sklearn"""
+        if ort is None or not ONNX_MODEL_PATH.exists():
+            return None
+        
+        try:
+            session = ort.InferenceSession(str(ONNX_MODEL_PATH), providers=['CPUExecutionProvider'])
             
-            self.model = joblib.load(model_path)
-            self.vectorizer = joblib.load(vectorizer_path)
+            # A stale export (e.g. after retraining the joblib model) must not win
+            exported_from = session.get_modelmeta().custom_metadata_map.get(ONNX_SOURCE_DIGEST_KEY)
+            if exported_from != file_digest(MODEL_PATH):
+                logger.warning("ONNX model was not exported from the current %s, using sklearn", MODEL_PATH.name)
+                return None
             
-            logger.info("Successfully loaded ML models")
+            input_width = session.get_inputs()[0].shape[1]
+            vocab_size = len(self.vectorizer.vocabulary_)
+            if input_width != vocab_size:
+                logger.warning("ONNX model expects %s features but the vectorizer has %d, using sklearn",
+                               input_width, vocab_size)
+                return None
             
+            logger.info("Successfully loaded ONNX model from %s", ONNX_MODEL_PATH.name)
+            return session
         except Exception as e:
-            logger.error(f"Error loading ML models: {str(e)}")
-            raise
+            logger.error("Error loading ONNX model, using sklearn: %s", e)
+            return None
     
-    def parse_email_file(self, file_content: bytes, filename: str) -> Dict[str, Any]:
-        """Parse email file content and extract information"""
+    def _load_joblib(self, path: Path, label: str) -> Any:
+        """Load a joblib artifact with its arrays memory-mapped read-only"""
         try:
-            # Save content to temporary file for mailparser
-            temp_path = Path(f"/tmp/{filename}")
-            with open(temp_path, 'wb') as f:
-                f.write(file_content)
+            if not path.exists():
+                raise FileNotFoundError(f"{label} file not found: {path}")
             
-            # Parse email
-            email = mailparser.parse_from_file(str(temp_path))
+            # mmap_mode lets uvicorn workers share the arrays via the page cache
+            obj = joblib.load(path, mmap_mode='r')
             
-            # Clean up temporary file
-            temp_path.unlink(missing_ok=True)
+            logger.info("Successfully loaded %s from %s", label.lower(), path.name)
+            return obj
             
-            # Extract email components
-            subject = email.subject or ''
-            sender = ''
-            if email.from_:
-                if isinstance(email.from_, list) and len(email.from_) > 0:
-                    sender = email.from_[0][1] if len(email.from_[0]) > 1 else str(email.from_[0])
-                else:
-                    sender = str(email.from_)
+        except Exception as e:
+            logger.error("Error loading %s: %s", label.lower(), e)
+            raise
+    
+    def load_models(self):
+        """Eagerly load the vectorizer and whichever classifier backend will be used"""
+        classifier = self.onnx_session or self.model
+        return classifier, self.vectorizer
+    
+    def warmup(self):
+        """Prime models, the IP kernel and sklearn's first-call paths before real traffic"""
+        try:
+            self.load_models()
+            email_data = self.parse_email_file(io.BytesIO(WARMUP_EML), "warm.eml")
+            self._predict_batch([f"{email_data['subject']} {email_data['body']}"])
+            logger.info("Email analyzer warmed up")
+        except Exception as e:
+            logger.error("Error warming up email analyzer: %s", e)
+    
+    def parse_email_file(self, fp: BinaryIO, filename: str) -> Dict[str, Any]:
+        """Parse an email from a binary stream and extract information"""
+        try:
+            # Parse email straight from the upload stream, without buffering it
+            msg = BytesParser(policy=policy.default).parse(fp)
             
-            body = email.body or ''
+            # Extract email components
+            subject = str(msg['subject'] or '')
+            sender = self._get_sender(msg)
+            body_parts = self._get_body_parts(msg)
+            body = "\n".join(body_parts)
             
             # Get headers as string for IP extraction
-            headers_text = str(email.headers) if email.headers else ''
-            combined_text = headers_text + "\n" + body
+            headers_text = "\n".join(f"{name}: {value}" for name, value in msg.items())
             
-            # Extract IP addresses
-            ip_addresses = self.extract_ip_addresses(combined_text)
+            # Scan headers and each body part once for IPs, URLs and suspicious words
+            ip_candidates = []
+            urls_detected = 0
+            suspicious_words = 0
+            for chunk in [headers_text, *body_parts]:
+                ip_candidates.extend(IP_RE.findall(chunk))
+                # Both counters match lowercase text, so lower each chunk only once
+                chunk_lower = chunk.lower()
+                urls_detected += self._count_urls_lower(chunk_lower)
+                suspicious_words += self._count_suspicious_lower(chunk_lower)
             
             return {
                 'subject': subject,
                 'sender': sender,
                 'body': body,
                 'headers': headers_text,
-                'ip_addresses': ip_addresses,
-                'combined_text': combined_text
+                'ip_addresses': self.filter_public_ips(ip_candidates),
+                'urls_detected': urls_detected,
+                'suspicious_words': suspicious_words
             }
             
         except Exception as e:
-            logger.error(f"Error parsing email file {filename}: {str(e)}")
+            logger.error("Error parsing email file %s: %s", filename, e)
             raise
     
-    def extract_ip_addresses(self, text: str) -> List[str]:
-        """Extract IP addresses from text"""
-        ip_pattern = r'\b(?:[0-9]{1,3}\.){3}[0-9]{1,3}\b'
-        ips = re.findall(ip_pattern, text)
+    def _get_sender(self, msg: EmailMessage) -> str:
+        """Return the first From: address, falling back to the raw header"""
+        from_header = msg['from']
+        if from_header is None:
+            return ''
         
-        # Filter out private/local IPs
-        public_ips = []
-        for ip in ips:
-            if self.is_public_ip(ip):
-                public_ips.append(ip)
+        addresses = getattr(from_header, 'addresses', ())
+        if addresses and addresses[0].addr_spec:
+            return addresses[0].addr_spec
+        return str(from_header)
+    
+    def _get_body_parts(self, msg: EmailMessage) -> List[str]:
+        """Return the decoded text parts of the email, skipping attachments"""
+        parts = []
+        for part in msg.walk():
+            if part.get_content_maintype() != 'text' or part.get_content_disposition() == 'attachment':
+                continue
+            
+            if part.get_content_charset() is not None:
+                try:
+                    parts.append(part.get_content())
+                    continue
+                except (LookupError, UnicodeError):
+                    pass
+            
+            # No, unknown or lying charset; the stdlib would decode a missing
+            # one as US-ASCII, so treat the bytes as UTF-8 and keep what we can
+            payload = part.get_payload(decode=True) or b''
+            parts.append(payload.decode('utf-8', errors='replace'))
         
+        return parts
+    
+    def extract_ip_addresses(self, text: str) -> List[str]:
+        """Extract public IP addresses from text"""
+        return self.filter_public_ips(IP_RE.findall(text))
+    
+    def filter_public_ips(self, candidates: List[str]) -> List[str]:
+        """Keep the public addresses among IP_RE matches, deduplicated in order"""
         # Remove duplicates while preserving order
-        return list(dict.fromkeys(public_ips))
+        ips = list(dict.fromkeys(candidates))
+        if not ips:
+            return []
+        
+        # Filter out private/local IPs in one compiled pass
+        mask = classify_ips(ips_to_octets(ips))
+        return [ip for ip, public in zip(ips, mask) if public]
     
     def is_public_ip(self, ip: str) -> bool:
-        """Check if IP address is public (not private/local)"""
-        return not (
-            ip.startswith("10.") or 
-            ip.startswith("192.168.") or 
-            ip.startswith("127.") or 
-            ip.startswith("172.") or
-            ip.startswith("0.") or
-            ip.startswith("255.")
-        )
-    
-    def get_geolocation(self, ip: str) -> Optional[Dict[str, str]]:
-        """Get geolocation data for IP address using ip-api.com"""
+        """Check if IP address is public (not private/local/reserved)"""
+        return bool(classify_ips(ips_to_octets([ip]))[0])
+    
+    async def get_geolocation(self, ips: List[str]) -> Dict[str, Dict[str, str]]:
+        """Get geolocation data for IP addresses using the ip-api.com batch endpoint"""
+        # Single lookup per IP; an entry can expire between a membership test and a read
+        locations = {}
+        for ip in ips:
+            location = self._geo_cache.get(ip)
+            if location is not None:
+                locations[ip] = location
+        misses = [ip for ip in dict.fromkeys(ips) if ip not in locations]
+        if not misses:
+            return locations
+        
         try:
-            response = requests.get(
-                f"http://ip-api.com/json/{ip}?fields=country,city,isp,status",
-                timeout=5
+            client = self.http_client
+            if client is None:
+                # Not running under the API server; fall back to a one-off client
+                async with httpx.AsyncClient(timeout=GEO_TIMEOUT) as client:
+                    await self._fetch_geolocation(client, misses, locations)
+            else:
+                await self._fetch_geolocation(client, misses, locations)
+            
+        except Exception as e:
+            logger.error("Error getting geolocation for %s: %s", misses, e)
+        
+        return locations
+    
+    async def _fetch_geolocation(self, client: httpx.AsyncClient, ips: List[str],
+                                 locations: Dict[str, Dict[str, str]]):
+        """Resolve IPs through ip-api.com/batch, filling the cache and locations"""
+        # One round-trip resolves up to GEO_BATCH_SIZE addresses
+        for i in range(0, len(ips), GEO_BATCH_SIZE):
+            response = await client.post(
+                "http://ip-api.com/batch?fields=query,country,city,isp,status",
+                json=[{"query": ip} for ip in ips[i:i + GEO_BATCH_SIZE]]
             )
             
-            if response.status_code == 200:
-                data = response.json()
+            if response.status_code != 200:
+                continue
+            
+            for data in response.json():
                 if data.get('status') == 'success':
-                    return {
+                    location = {
                         'city': data.get('city', 'Unknown'),
                         'country': data.get('country', 'Unknown'),
                         'isp': data.get('isp', 'Unknown')
                     }
-            
-            return None
-            
-        except Exception as e:
-            logger.error(f"Error getting geolocation for {ip}: {str(e)}")
-            return None
+                    self._geo_cache[data['query']] = location
+                    locations[data['query']] = location
     
     def count_urls(self, text: str) -> int:
         """Count URLs in text"""
-        url_pattern = r'https?://[^\s<>"\']+|www\.[^\s<>"\']+|[^\s]+\.[a-z]{2,}[^\s]*'
-        urls = re.findall(url_pattern, text.lower())
-        return len(urls)
+        return self._count_urls_lower(text.lower())
     
     def count_suspicious_words(self, text: str) -> int:
         """Count suspicious words that might indicate phishing"""
-        suspicious_words = [
-            'urgent', 'immediate', 'verify', 'confirm', 'suspend', 'limited',
-            'expire', 'click', 'login', 'update', 'security', 'account',
-            'bank', 'paypal', 'amazon', 'microsoft', 'apple', 'google',
-            'winner', 'congratulations', 'prize', 'lottery', 'inheritance',
-            'prince', 'million', 'transfer', 'fund', 'beneficiary',
-            'act now', 'limited time', 'expires today', 'final notice'
-        ]
-        
-        text_lower = text.lower()
-        count = 0
-        for word in suspicious_words:
-            count += text_lower.count(word)
-        
-        return count
-    
-    def predict_phishing(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
+        return self._count_suspicious_lower(text.lower())
+    
+    def _count_urls_lower(self, text_lower: str) -> int:
+        """Count URLs in already-lowercased text"""
+        return sum(1 for _ in URL_RE.finditer(text_lower))
+    
+    def _count_suspicious_lower(self, text_lower: str) -> int:
+        """Count suspicious words in already-lowercased text"""
+        return sum(1 for _ in SUSPICIOUS_AUTOMATON.iter(text_lower))
+    
+    def _predict_batch(self, texts: List[str]) -> List[Tuple[Any, float]]:
+        """Run TF-IDF + classifier on a batch of texts, returning (label, confidence %)"""
+        X_input = self.vectorizer.transform(texts)
+        
+        session = self.onnx_session
+        if session is not None:
+            labels, probas = session.run(None, {'input': X_input.toarray().astype(np.float32)})
+            return [(label, float(row.max()) * 100) for label, row in zip(labels, probas)]
+        
+        probas = self.model.predict_proba(X_input)
+        classes = self.model.classes_
+        return [(classes[row.argmax()], float(row.max()) * 100) for row in probas]
+    
+    async def predict_phishing(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """Predict if email is phishing using ML model"""
         try:
             # Prepare input text for ML model
             input_text = f"{email_data['subject']} {email_data['body']}"
             
-            # Transform text using TF-IDF vectorizer
-            X_input = self.vectorizer.transform([input_text])
-            
-            # Make prediction
-            prediction = self.model.predict(X_input)[0]
-            prediction_proba = self.model.predict_proba(X_input)[0]
-            
-            # Get confidence score
-            confidence = max(prediction_proba) * 100
-            
-            # Get additional analysis
-            urls_detected = self.count_urls(email_data['combined_text'])
-            suspicious_words = self.count_suspicious_words(email_data['combined_text'])
+            if len(input_text.strip()) < MIN_CLASSIFIABLE_CHARS:
+                # Nothing for the model to work with (e.g. attachment-only forwards)
+                self.unclassifiable_count += 1
+                logger.info("Skipping prediction for near-empty email (%d so far)", self.unclassifiable_count)
+                prediction, confidence = None, UNCLASSIFIABLE_CONFIDENCE
+            else:
+                # Classify alongside any concurrent requests
+                prediction, confidence = await self.batcher.predict(input_text)
             
             # Get geolocation for first IP if available
             location = None
             ip_address = None
             if email_data['ip_addresses']:
                 ip_address = email_data['ip_addresses'][0]
-                location = self.get_geolocation(ip_address)
+                locations = await self.get_geolocation([ip_address])
+                location = locations.get(ip_address)
+            
+            # One clock read shared by the display date and the stored timestamp
+            analyzed_at = datetime.now(timezone.utc)
             
             return {
                 'classification': 'PHISHING' if prediction == 1 else 'SAFE',
@@ -191,28 +502,90 @@ class EmailAnalyzer:
                 'body': email_data['body'],
                 'ip_address': ip_address,
                 'location': location,
-                'urls_detected': urls_detected,
-                'suspicious_words': suspicious_words,
-                'analysis_date': datetime.utcnow().isoformat()
+                'urls_detected': email_data['urls_detected'],
+                'suspicious_words': email_data['suspicious_words'],
+                'analysis_date': analyzed_at.isoformat(),
+                'timestamp': analyzed_at
             }
             
         except Exception as e:
-            logger.error(f"Error predicting phishing: {str(e)}")
+            logger.error("Error predicting phishing: %s", e)
             raise
     
-    def analyze_email(self, file_content: bytes, filename: str) -> Dict[str, Any]:
+    def content_hash(self, fp: BinaryIO) -> str:
+        """Hash a binary email stream into a cache key, rewinding it afterwards"""
+        digest = hashlib.blake2b(digest_size=16)
+        for chunk in iter(lambda: fp.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        fp.seek(0)
+        return digest.hexdigest()
+    
+    async def _get_cached_result(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of a cached analysis result, refreshing its LRU position"""
+        entry = self._result_cache.get(key)
+        if entry is None:
+            return None
+        
+        self._result_cache.move_to_end(key)
+        result = dict(entry[0])
+        
+        # Location isn't cached here; the geolocation TTL cache decides when it
+        # expires, and failed lookups get retried
+        result['location'] = None
+        if result['ip_address']:
+            locations = await self.get_geolocation([result['ip_address']])
+            result['location'] = locations.get(result['ip_address'])
+        
+        analyzed_at = datetime.now(timezone.utc)
+        result['analysis_date'] = analyzed_at.isoformat()
+        result['timestamp'] = analyzed_at
+        return result
+    
+    def _result_size(self, result: Dict[str, Any]) -> int:
+        """Approximate memory held by a result; dominated by its string fields"""
+        return sum(sys.getsizeof(value) for value in result.values() if isinstance(value, str))
+    
+    def _cache_result(self, key: str, result: Dict[str, Any]):
+        """Store an analysis result, evicting least recently used entries to stay within limits"""
+        size = self._result_size(result)
+        if size > self.cache_max_bytes:
+            # Caching it would flush everything else for a single upload
+            return
+        
+        old = self._result_cache.pop(key, None)
+        if old is not None:
+            self._result_cache_bytes -= old[1]
+        
+        entry = {name: value for name, value in result.items() if name != 'location'}
+        self._result_cache[key] = (entry, size)
+        self._result_cache_bytes += size
+        while len(self._result_cache) > self.cache_size or self._result_cache_bytes > self.cache_max_bytes:
+            _, (_, evicted_size) = self._result_cache.popitem(last=False)
+            self._result_cache_bytes -= evicted_size
+    
+    async def analyze_email(self, fp: BinaryIO, filename: str) -> Dict[str, Any]:
         """Complete email analysis pipeline"""
         try:
+            # Hashing and parsing are CPU/disk bound; keep them off the event loop
+            loop = asyncio.get_running_loop()
+            
+            # Identical uploads skip parsing and prediction
+            key = await loop.run_in_executor(None, self.content_hash, fp)
+            cached = await self._get_cached_result(key)
+            if cached is not None:
+                return cached
+            
             # Parse email
-            email_data = self.parse_email_file(file_content, filename)
+            email_data = await loop.run_in_executor(None, self.parse_email_file, fp, filename)
             
             # Predict phishing
-            result = self.predict_phishing(email_data)
+            result = await self.predict_phishing(email_data)
             
+            self._cache_result(key, result)
             return result
             
         except Exception as e:
-            logger.error(f"Error analyzing email {filename}: {str(e)}")
+            logger.error("Error analyzing email %s: %s", filename, e)
             raise
 
 # Global analyzer instance
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Export the phishing classifier to ONNX for inference with ONNX Runtime
+
+Offline tool; needs skl2onnx and onnx on top of the backend requirements:
+    pip install skl2onnx onnx
+    python export_onnx.py
+"""
+
+import argparse
+import logging
+from pathlib import Path
+
+import joblib
+from skl2onnx import convert_sklearn
+from skl2onnx.common.data_types import FloatTensorType
+from onnx.helper import set_model_props
+from onnxruntime.quantization import quantize_dynamic, QuantType
+
+from email_analyzer import (
+    MODEL_PATH, VECTORIZER_PATH, ONNX_MODEL_PATH, ONNX_SOURCE_DIGEST_KEY, file_digest
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def export_model(output_path: Path, quantize: bool = True):
+    """Convert the joblib classifier to ONNX, optionally int8-quantizing its weights"""
+    model = joblib.load(MODEL_PATH)
+    vectorizer = joblib.load(VECTORIZER_PATH)
+    vocab_size = len(vectorizer.vocabulary_)
+
+    # zipmap off so probabilities come back as a plain (n, classes) tensor
+    onx = convert_sklearn(
+        model,
+        initial_types=[('input', FloatTensorType([None, vocab_size]))],
+        options={id(model): {'zipmap': False}}
+    )
+    # Record which joblib model this came from so the server can detect stale exports
+    set_model_props(onx, {ONNX_SOURCE_DIGEST_KEY: file_digest(MODEL_PATH)})
+    output_path.write_bytes(onx.SerializeToString())
+    logger.info("Exported %s (%d features) to %s", type(model).__name__, vocab_size, output_path)
+
+    if not quantize:
+        return
+
+    try:
+        quantize_dynamic(str(output_path), str(output_path), weight_type=QuantType.QInt8)
+        logger.info("Quantized %s to int8", output_path)
+    except ValueError as e:
+        # Tree ensembles only use ai.onnx.ml operators, which have no int8 kernels
+        logger.warning("Skipping int8 quantization: %s", e)
+
+def main():
+    """Main export execution"""
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--output", type=Path, default=ONNX_MODEL_PATH,
+                        help="where to write the ONNX model")
+    parser.add_argument("--no-quantize", action="store_true",
+                        help="keep float weights instead of int8")
+    args = parser.parse_args()
+
+    export_model(args.output, quantize=not args.no_quantize)
+
+if __name__ == "__main__":
+    main()
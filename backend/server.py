@@ -1,22 +1,32 @@
 from fastapi import FastAPI, APIRouter, File, UploadFile, HTTPException
 from fastapi.responses import StreamingResponse
 from dotenv import load_dotenv
+from pythonjsonlogger.json import JsonFormatter
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import AsyncIterator, Iterable, List, Optional
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 import csv
 import io
-from email_analyzer import analyzer
+import httpx
+from email_analyzer import analyzer, GEO_TIMEOUT
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Configure logging once for the whole app, as JSON lines; set LOG_LEVEL=WARNING
+# in production to drop per-request info records
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(JsonFormatter('%(asctime)s %(name)s %(levelname)s %(message)s'))
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), handlers=[log_handler])
+logger = logging.getLogger(__name__)
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
@@ -42,16 +52,26 @@ class AnalysisResult(BaseModel):
     suspicious_words: int
     analysis_date: str
     filename: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class StatusCheck(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     client_name: str
-    timestamp: datetime = Field(default_factory=datetime.utcnow)
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+async def stream_csv(rows: Iterable[Iterable]) -> AsyncIterator[bytes]:
+    """Encode CSV rows one at a time so responses never hold the whole file"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+
 # Add your routes to the router instead of directly to app
 @api_router.get("/")
 async def root():
@@ -76,37 +96,43 @@ async def analyze_email(file: UploadFile = File(...)):
         )
     
     try:
-        # Read file content
-        file_content = await file.read()
-        
-        if not file_content:
+        # Peek at the spooled upload instead of reading it all into memory;
+        # UploadFile does the I/O in a worker thread once the upload is on disk
+        if not await file.read(1):
             raise HTTPException(status_code=400, detail="Empty file uploaded")
+        await file.seek(0)
         
-        # Analyze email
-        analysis_result = analyzer.analyze_email(file_content, file.filename)
+        # Analyze email straight from the upload stream
+        analysis_result = await analyzer.analyze_email(file.file, file.filename)
         
-        # Create result model
-        result = AnalysisResult(
-            classification=analysis_result['classification'],
-            confidence=analysis_result['confidence'],
-            sender=analysis_result['sender'],
-            subject=analysis_result['subject'],
-            body=analysis_result['body'],
-            ip_address=analysis_result['ip_address'],
-            location=analysis_result['location'],
-            urls_detected=analysis_result['urls_detected'],
-            suspicious_words=analysis_result['suspicious_words'],
-            analysis_date=analysis_result['analysis_date'],
-            filename=file.filename
-        )
+        # Build the stored document directly; the analyzer output is already typed
+        payload = {
+            'id': str(uuid.uuid4()),
+            'classification': analysis_result['classification'],
+            'confidence': analysis_result['confidence'],
+            'sender': analysis_result['sender'],
+            'subject': analysis_result['subject'],
+            'body': analysis_result['body'],
+            'ip_address': analysis_result['ip_address'],
+            'location': analysis_result['location'],
+            'urls_detected': analysis_result['urls_detected'],
+            'suspicious_words': analysis_result['suspicious_words'],
+            'analysis_date': analysis_result['analysis_date'],
+            'filename': file.filename,
+            'timestamp': analysis_result['timestamp']
+        }
         
         # Store result in database
-        await db.analysis_results.insert_one(result.dict())
+        await db.analysis_results.insert_one(payload)
+        
+        result = AnalysisResult.model_construct(**payload)
         
         return result
         
+    except HTTPException:
+        raise
     except Exception as e:
-        logging.error(f"Error analyzing email: {str(e)}")
+        logger.error("Error analyzing email: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error analyzing email: {str(e)}"
@@ -122,41 +148,29 @@ async def download_analysis_csv(analysis_id: str):
         if not result:
             raise HTTPException(status_code=404, detail="Analysis result not found")
         
-        # Create CSV content
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write CSV headers and data
-        writer.writerow(['Field', 'Value'])
-        writer.writerow(['Classification', result['classification']])
-        writer.writerow(['Confidence', f"{result['confidence']}%"])
-        writer.writerow(['Sender', result['sender']])
-        writer.writerow(['Subject', result['subject']])
-        writer.writerow(['IP Address', result['ip_address'] or 'N/A'])
-        
         location_str = 'N/A'
         if result['location']:
             location_str = f"{result['location'].get('city', '')}, {result['location'].get('country', '')}"
-        writer.writerow(['Location', location_str])
-        
-        writer.writerow(['URLs Detected', result['urls_detected']])
-        writer.writerow(['Suspicious Words', result['suspicious_words']])
-        writer.writerow(['Analysis Date', result['analysis_date']])
-        writer.writerow(['Filename', result['filename']])
         
-        # Prepare response
-        output.seek(0)
-        csv_content = output.getvalue()
-        output.close()
-        
-        # Create streaming response
-        def generate():
-            yield csv_content
+        # CSV headers and data
+        rows = [
+            ['Field', 'Value'],
+            ['Classification', result['classification']],
+            ['Confidence', f"{result['confidence']}%"],
+            ['Sender', result['sender']],
+            ['Subject', result['subject']],
+            ['IP Address', result['ip_address'] or 'N/A'],
+            ['Location', location_str],
+            ['URLs Detected', result['urls_detected']],
+            ['Suspicious Words', result['suspicious_words']],
+            ['Analysis Date', result['analysis_date']],
+            ['Filename', result['filename']],
+        ]
         
         filename = f"email-analysis-{result['filename']}-{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
         
         return StreamingResponse(
-            io.BytesIO(csv_content.encode('utf-8')),
+            stream_csv(rows),
             media_type="text/csv",
             headers={"Content-Disposition": f"attachment; filename={filename}"}
         )
@@ -164,7 +178,7 @@ async def download_analysis_csv(analysis_id: str):
     except HTTPException:
         raise
     except Exception as e:
-        logging.error(f"Error generating CSV: {str(e)}")
+        logger.error("Error generating CSV: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error generating CSV: {str(e)}"
@@ -174,10 +188,13 @@ async def download_analysis_csv(analysis_id: str):
 async def get_recent_analyses(limit: int = 10):
     """Get recent analysis results"""
     try:
-        analyses = await db.analysis_results.find().sort("timestamp", -1).limit(limit).to_list(limit)
-        return [AnalysisResult(**analysis) for analysis in analyses]
+        # The list view never shows the email body, so don't ship it over the wire
+        analyses = await db.analysis_results.find(
+            {}, projection={"_id": 0, "body": 0}
+        ).sort("timestamp", -1).limit(limit).to_list(limit)
+        return [AnalysisResult.model_construct(**analysis) for analysis in analyses]
     except Exception as e:
-        logging.error(f"Error fetching analyses: {str(e)}")
+        logger.error("Error fetching analyses: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error fetching analyses: {str(e)}"
@@ -193,7 +210,7 @@ async def create_status_check(input: StatusCheckCreate):
 @api_router.get("/status", response_model=List[StatusCheck])
 async def get_status_checks():
     status_checks = await db.status_checks.find().to_list(1000)
-    return [StatusCheck(**status_check) for status_check in status_checks]
+    return [StatusCheck.model_construct(**status_check) for status_check in status_checks]
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -206,13 +223,38 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+@app.on_event("startup")
+async def create_indexes():
+    # Lets /analyses read the newest results from the index instead of sorting the collection
+    try:
+        await db.analysis_results.create_index([("timestamp", -1)])
+    except Exception as e:
+        # Don't take the API down with Mongo; a missing index only costs a collection scan
+        logger.warning("Could not create timestamp index: %s", e)
+
+@app.on_event("startup")
+async def create_http_client():
+    # One pooled client so geolocation lookups reuse keep-alive connections
+    app.state.http = httpx.AsyncClient(
+        timeout=GEO_TIMEOUT,
+        limits=httpx.Limits(max_keepalive_connections=20)
+    )
+    analyzer.http_client = app.state.http
+
+@app.on_event("startup")
+async def warmup_analyzer():
+    # Run in a worker thread so startup isn't blocked on model loading / JIT
+    app.state.warmup = asyncio.get_running_loop().run_in_executor(None, analyzer.warmup)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+
+@app.on_event("shutdown")
+async def close_http_client():
+    analyzer.http_client = None
+    await app.state.http.aclose()
+
+@app.on_event("shutdown")
+async def close_prediction_batcher():
+    await analyzer.batcher.close()
\ No newline at end of file
@@ -0,0 +1,52 @@
+"""
+Tests for the compiled public IPv4 classifier in email_analyzer
+"""
+
+import ipaddress
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from email_analyzer import classify_ips, ips_to_octets
+
+# Older ipaddress releases treat parts of 192.0.0.0/24 as global, newer ones don't;
+# the kernel treats the whole block as non-public, so it is pinned below instead
+STDLIB_VERSION_DEPENDENT = ipaddress.ip_network("192.0.0.0/24")
+
+def expected_public(ip):
+    """Reference answer from the standard library; multicast is never a sender"""
+    address = ipaddress.ip_address(ip)
+    return address.is_global and not address.is_multicast
+
+def test_matches_ipaddress_on_fixed_sample():
+    rng = random.Random(1234)
+    ips = [".".join(str(rng.randrange(256)) for _ in range(4)) for _ in range(20000)]
+    # Make sure every special-purpose block is exercised, not just hit by chance
+    ips += [
+        "0.0.0.1", "10.1.2.3", "100.63.255.255", "100.64.0.1", "100.127.255.255", "100.128.0.1",
+        "127.0.0.1", "169.254.1.1", "172.15.255.255", "172.31.255.255", "172.32.0.0",
+        "192.0.1.1", "192.0.2.1", "192.88.99.1", "192.168.1.1",
+        "198.17.255.255", "198.18.0.1", "198.19.255.255", "198.20.0.1", "198.51.100.7",
+        "203.0.113.9", "223.255.255.255", "224.0.0.1", "240.0.0.1", "255.255.255.255",
+    ]
+
+    mask = classify_ips(ips_to_octets(ips))
+
+    mismatches = [
+        ip for ip, public in zip(ips, mask)
+        if ipaddress.ip_address(ip) not in STDLIB_VERSION_DEPENDENT and bool(public) != expected_public(ip)
+    ]
+    assert mismatches == []
+
+@pytest.mark.parametrize("ip, public", [
+    ("172.32.0.1", True),
+    ("172.16.0.1", False),
+    ("999.1.1.1", False),
+    ("192.0.0.8", False),
+])
+def test_pinned_addresses(ip, public):
+    assert bool(classify_ips(ips_to_octets([ip]))[0]) is public
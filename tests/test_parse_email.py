@@ -0,0 +1,38 @@
+"""
+Tests for decoding uploaded emails in email_analyzer
+"""
+
+import io
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from email_analyzer import EmailAnalyzer
+
+def parse(raw):
+    return EmailAnalyzer().parse_email_file(io.BytesIO(raw), "test.eml")
+
+def test_utf8_body_without_charset():
+    raw = (
+        "From: sicherheit@example.com\r\n"
+        "Subject: Konto\r\n"
+        "Content-Type: text/plain\r\n"
+        "Content-Transfer-Encoding: 8bit\r\n"
+        "\r\n"
+        "Bitte bestätigen Sie Ihre Identität\r\n"
+    ).encode("utf-8")
+
+    assert parse(raw)["body"].strip() == "Bitte bestätigen Sie Ihre Identität"
+
+def test_declared_charset_is_honoured():
+    raw = (
+        "From: sicherheit@example.com\r\n"
+        "Subject: Konto\r\n"
+        "Content-Type: text/plain; charset=iso-8859-1\r\n"
+        "Content-Transfer-Encoding: 8bit\r\n"
+        "\r\n"
+        "Bitte bestätigen Sie Ihre Identität\r\n"
+    ).encode("iso-8859-1")
+
+    assert parse(raw)["body"].strip() == "Bitte bestätigen Sie Ihre Identität"
@@ -0,0 +1,52 @@
+"""
+Tests for the content-hash result cache in email_analyzer
+"""
+
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from email_analyzer import EmailAnalyzer
+
+EML = (
+    b"From: security@example.com\r\n"
+    b"Subject: Verify your account\r\n"
+    b"Received: from relay.example.com (8.8.8.8) by mail.example.com\r\n"
+    b"\r\n"
+    b"Click http://example.com/verify to confirm your account\r\n"
+)
+
+def test_failed_geolocation_is_retried_on_cache_hit():
+    statuses = [429, 200]
+
+    def handler(request):
+        status = statuses.pop(0)
+        if status != 200:
+            return httpx.Response(status)
+        return httpx.Response(200, json=[{
+            'query': '8.8.8.8', 'status': 'success',
+            'city': 'Mountain View', 'country': 'United States', 'isp': 'Google LLC'
+        }])
+
+    async def run():
+        analyzer = EmailAnalyzer()
+        # Classification isn't under test; skip loading the model
+        analyzer.batcher.predict_batch = lambda texts: [(0, 90.0) for _ in texts]
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            analyzer.http_client = client
+            first = await analyzer.analyze_email(io.BytesIO(EML), "a.eml")
+            second = await analyzer.analyze_email(io.BytesIO(EML), "a.eml")
+        await analyzer.batcher.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first['location'] is None
+    assert second['ip_address'] == '8.8.8.8'
+    assert second['location'] == {'city': 'Mountain View', 'country': 'United States', 'isp': 'Google LLC'}
+    assert statuses == []